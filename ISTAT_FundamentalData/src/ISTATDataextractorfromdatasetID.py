@@ -1,14 +1,16 @@
 import requests
-import json
+import orjson
 import os
 import logging
-from xml.etree import ElementTree as ET
-from typing import Dict, List, Optional
+from requests.adapters import HTTPAdapter
+from lxml import etree
+from typing import Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
+from pathlib import Path
 
 # Set up logging
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
         logging.FileHandler('istat_series_extractor.log'),
@@ -17,6 +19,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Namespace-qualified (Clark notation) tag names, computed once
+GEN = 'http://www.sdmx.org/resources/sdmxml/schemas/v2_1/data/generic'
+NS = {'generic': GEN}
+TAG_SERIES = f'{{{GEN}}}Series'
+
+# Compiled XPath expressions used for every series; plain (non-smart) strings
+# so extracted values don't keep a reference back to the parsed tree
+_SERIES_KEYS = etree.XPath('./generic:SeriesKey/generic:Value', namespaces=NS)
+_OBS = etree.XPath('./generic:Obs', namespaces=NS)
+_OBS_TIME = etree.XPath(
+    'string(./generic:ObsDimension[@id="TIME_PERIOD"]/@value)', namespaces=NS, smart_strings=False
+)
+_OBS_VAL = etree.XPath('string(./generic:ObsValue/@value)', namespaces=NS, smart_strings=False)
+
+def _to_float(value: str):
+    """Convert a single observation value, keeping it as-is if it isn't numeric."""
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
 def find_constraints_file(dataset_id: str) -> str:
     """Find the constraints file for the given dataset ID."""
     constraints_dir = r"C:\Users\Antonio\Streamlit app\constraints"
@@ -33,9 +56,12 @@ def find_constraints_file(dataset_id: str) -> str:
     return constraints_path
 
 class IstatSeriesExtractor:
+    BASE_URL = "https://sdmx.istat.it/SDMXWS/rest"
+    _DATA_URL = BASE_URL + "/data/{ds}"
+
     def __init__(self, dataset_id: str, output_dir: str = "./series_data"):
         self.dataset_id = dataset_id
-        self.base_url = "https://sdmx.istat.it/SDMXWS/rest"
+        self._data_url = self._DATA_URL.format(ds=dataset_id)
         self.output_dir = output_dir
         
         # Automatically find the constraints file
@@ -49,10 +75,17 @@ class IstatSeriesExtractor:
             'common': 'http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common'
         }
         
+        # Keep-alive session shared by all requests to the SDMX endpoints
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        
         # Load and validate constraints
         self.constraints = self.load_constraints()
         self.validate_constraints()
         
+        # Descriptions resolved so far, keyed on (concept, code)
+        self._desc_cache: Dict[Tuple[str, str], str] = {}
+        
         os.makedirs(output_dir, exist_ok=True)
 
     def validate_constraints(self):
@@ -67,156 +100,181 @@ class IstatSeriesExtractor:
     def load_constraints(self) -> Dict:
         """Load the constraints mapping file."""
         try:
-            with open(self.constraints_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(self.constraints_path, 'rb') as f:
+                return orjson.loads(f.read())
         except Exception as e:
             logger.error(f"Error loading constraints file: {str(e)}")
             raise
 
-    def fetch_series_data(self) -> ET.Element:
-        """Fetch series data from ISTAT API."""
+    def fetch_series_data(self) -> Iterator[Tuple[str, etree._Element]]:
+        """Fetch series data from ISTAT API as a stream of parsed Series elements."""
         try:
-            url = f"{self.base_url}/data/{self.dataset_id}"
+            url = self._data_url
             logger.info(f"Fetching data from: {url}")
             
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            return ET.fromstring(response.content)
+            # Parse straight from the socket (gzip decoded on the fly) instead of
+            # materializing response.content; the connection is released once
+            # the stream is exhausted or abandoned
+            with self.session.get(url, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                
+                # Only subscribe to 'end' events of Series elements: each one is
+                # complete (SeriesKey and all Obs) when it is yielded
+                yield from etree.iterparse(response.raw, events=('end',), tag=TAG_SERIES)
         except Exception as e:
             logger.error(f"Error fetching series data: {str(e)}")
             raise
 
     def get_value_description(self, concept: str, code: str) -> str:
         """Get description for a value, with proper fallback handling."""
-        try:
-            logger.debug(f"Getting description for concept: {concept}, code: {code}")
+        key = (concept, code)
+        description = self._desc_cache.get(key)
+        if description is None:
+            description = self._resolve_value_description(concept, code)
+            self._desc_cache[key] = description
+        return description
+
+    def _resolve_value_description(self, concept: str, code: str) -> str:
+        """Look up the description for a value in the constraints file."""
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("Getting description for concept: %s, code: %s", concept, code)
+        
+        if concept in self.constraints["dimensions"]:
+            dimension_info = self.constraints["dimensions"][concept]
+            value_info = dimension_info.get("values", {}).get(code, {})
             
-            if concept in self.constraints["dimensions"]:
-                dimension_info = self.constraints["dimensions"][concept]
-                value_info = dimension_info["values"].get(code, {})
-                
-                # Try to get name in different languages
-                names = value_info.get("name", {})
-                description = (
-                    names.get("en") or  # Try English first
-                    names.get("it") or  # Then Italian
-                    names.get("default", code)  # Fall back to code if no translations
-                )
-                
-                logger.debug(f"Found description for {concept}-{code}: {description}")
-                return description
+            # Try to get name in different languages
+            names = value_info.get("name", {})
+            description = (
+                names.get("en") or  # Try English first
+                names.get("it") or  # Then Italian
+                names.get("default", code)  # Fall back to code if no translations
+            )
             
-            logger.warning(f"No dimension info found for concept: {concept}")
-            return code
-        except Exception:
-            logger.error(f"Error getting description for {concept}-{code}")
-            return code
+            if debug:
+                logger.debug("Found description for %s-%s: %s", concept, code, description)
+            return description
+        
+        logger.warning(f"No dimension info found for concept: {concept}")
+        return code
 
-    def extract_series_key(self, series_elem: ET.Element) -> Dict:
+    def extract_series_key(self, series_elem: etree._Element) -> Dict:
         """Extract and map values from a series key element."""
-        try:
-            # Initialize with dataset_info at the top
-            series_data = {
-                "dataset_info": {
-                    "id": self.dataset_id,
-                    "names": self.constraints["dataset_info"]["names"],
-                    "structure_reference": self.constraints["dataset_info"]["structure_reference"],
-                    "generated_at": datetime.now().isoformat()
-                },
-                "metadata": {},
-                "observations": []
+        # Initialize with dataset_info at the top
+        series_data = {
+            "dataset_info": {
+                "id": self.dataset_id,
+                "names": self.constraints["dataset_info"]["names"],
+                "structure_reference": self.constraints["dataset_info"]["structure_reference"],
+                "generated_at": datetime.now().isoformat()
+            },
+            "metadata": {},
+            # Observations are stored column-wise as parallel lists
+            "observations": {
+                "time_period": [],
+                "value": []
             }
+        }
+        
+        # Bind hot-loop lookups to locals once
+        get_desc = self.get_value_description
+        metadata = series_data["metadata"]
+        times = series_data["observations"]["time_period"]
+        values = series_data["observations"]["value"]
+        times_append = times.append
+        values_append = values.append
+        
+        # Extract series key values
+        for value in _SERIES_KEYS(series_elem):
+            concept = value.get('id')
+            code = value.get('value')
             
-            # Extract series key values
-            series_key = series_elem.find('generic:SeriesKey', self.namespaces)
-            if series_key is not None:
-                for value in series_key.findall('.//generic:Value', self.namespaces):
-                    concept = value.attrib.get('id')
-                    code = value.attrib.get('value')
-                    
-                    # Get description using the helper method
-                    description = self.get_value_description(concept, code)
-                    
-                    series_data["metadata"][concept] = {
-                        "code": code,
-                        "description": description
-                    }
-
-            # Extract observations
-            for obs in series_elem.findall('generic:Obs', self.namespaces):
-                observation = {}
-                
-                # Get time period from ObsDimension
-                time_dim = obs.find('generic:ObsDimension[@id="TIME_PERIOD"]', self.namespaces)
-                if time_dim is not None:
-                    observation["time_period"] = time_dim.attrib.get('value')
-                
-                # Get observation value from ObsValue
-                obs_value = obs.find('generic:ObsValue', self.namespaces)
-                if obs_value is not None:
-                    value = obs_value.attrib.get('value')
-                    if value:
-                        try:
-                            observation["value"] = float(value)
-                        except ValueError:
-                            observation["value"] = value
-                
-                # Only add observation if we have both time and value
-                if "time_period" in observation and "value" in observation:
-                    series_data["observations"].append(observation)
+            # Get description using the helper method
+            description = get_desc(concept, code)
             
-            # Sort observations by time period
-            if series_data["observations"]:
-                series_data["observations"].sort(key=lambda x: x.get("time_period", ""))
+            metadata[concept] = {
+                "code": code,
+                "description": description
+            }
+
+        # Extract observations, noting whether they arrive out of time order
+        last_tp = ""
+        needs_sort = False
+        for obs in _OBS(series_elem):
+            time_period = _OBS_TIME(obs)
+            value = _OBS_VAL(obs)
             
-            return series_data
-        except Exception as e:
-            logger.error(f"Error extracting series key: {str(e)}")
-            raise
+            # Only add observation if we have both time and value
+            if time_period and value:
+                times_append(time_period)
+                values_append(value)
+                if time_period < last_tp:
+                    needs_sort = True
+                last_tp = time_period
+        
+        # Sort observations by time period, only if the response wasn't already ordered
+        if needs_sort:
+            order = sorted(range(len(times)), key=times.__getitem__)
+            times[:] = [times[j] for j in order]
+            values[:] = [values[j] for j in order]
+        
+        # Convert values in one batch; only fall back to per-value
+        # conversion when the series contains non-numeric entries
+        try:
+            values[:] = list(map(float, values))
+        except ValueError:
+            values[:] = [_to_float(v) for v in values]
+        
+        return series_data
 
     def process_series(self):
         """Process all series in the dataset."""
         try:
-            # Fetch data
-            root = self.fetch_series_data()
-            
-            # Find all series elements
-            series_elements = root.findall('.//generic:Series', self.namespaces)
-            total_series = len(series_elements)
-            logger.info(f"Found {total_series} series to process")
-            
-            # Process each series
-            for i, series_elem in enumerate(series_elements, 1):
+            # Stream series elements as they are parsed
+            out_dir = self.output_dir
+            total_series = 0
+            for i, (_, series_elem) in enumerate(self.fetch_series_data(), 1):
+                total_series = i
                 try:
-                    logger.info(f"Processing series {i}/{total_series}")
+                    logger.info(f"Processing series {i}")
                     
                     # Extract series data
                     series_data = self.extract_series_key(series_elem)
                     
                     # Skip if no observations found
-                    if not series_data["observations"]:
+                    if not series_data["observations"]["time_period"]:
                         logger.warning(f"No observations found for series {i}")
                         continue
                     
                     # Create unique filename based on metadata INCLUDING DATASET ID
-                    filename_parts = [f"dataset_{self.dataset_id}"]
-                    for concept, info in series_data["metadata"].items():
-                        filename_parts.append(f"{concept}-{info['code']}")
-                    
-                    filename = f"series_{'_'.join(filename_parts)}.json"
-                    output_path = os.path.join(self.output_dir, filename)
+                    filename = (
+                        "series_dataset_" + self.dataset_id + "_"
+                        + "_".join(f"{concept}-{info['code']}" for concept, info in series_data["metadata"].items())
+                        + ".json"
+                    )
+                    output_path = os.path.join(out_dir, filename)
                     
                     # Save to file
-                    with open(output_path, 'w', encoding='utf-8') as f:
-                        json.dump(series_data, f, indent=2, ensure_ascii=False)
+                    Path(output_path).write_bytes(
+                        orjson.dumps(series_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+                    )
                     
                     logger.info(f"Saved series data to: {output_path}")
                 
                 except Exception as e:
                     logger.error(f"Error processing series {i}: {str(e)}")
                     continue
+                
+                finally:
+                    # Free the processed series and its already-handled siblings
+                    # so memory stays flat regardless of the response size
+                    series_elem.clear()
+                    while series_elem.getprevious() is not None:
+                        del series_elem.getparent()[0]
             
-            logger.info("Series extraction completed")
+            logger.info(f"Series extraction completed: {total_series} series processed")
             
         except Exception as e:
             logger.error(f"Error processing series: {str(e)}")
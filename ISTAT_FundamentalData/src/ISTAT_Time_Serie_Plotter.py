@@ -1,11 +1,20 @@
-import json
+import numpy as np
+import orjson
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # No GUI backend needed, plots are only saved to disk
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pathlib import Path
 import logging
 from typing import Dict, List, Optional
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    import numba
+except ImportError:  # Numba is optional, growth rates fall back to NumPy
+    numba = None
 
 # Set up logging
 logging.basicConfig(
@@ -14,21 +23,70 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _growth(vals: np.ndarray, periods: int) -> np.ndarray:
+    """Percentage change over `periods` observations, NaN for the first `periods`."""
+    n = vals.shape[0]
+    out = np.empty(n, dtype=np.float64)
+    for i in range(min(periods, n)):
+        out[i] = np.nan
+    for i in range(periods, n):
+        out[i] = (vals[i] / vals[i - periods] - 1.0) * 100.0
+    return out
+
+if numba is not None:
+    # Compiled eagerly for read-only float64 input (what pandas hands out) and
+    # cached on disk. No fastmath: series can contain NaN. NumPy error model so
+    # a zero base gives inf rather than raising
+    _growth = numba.njit(
+        numba.float64[:](numba.types.Array(numba.float64, 1, 'A', readonly=True), numba.int64),
+        cache=True,
+        error_model='numpy'
+    )(_growth)
+else:
+    def _growth(vals: np.ndarray, periods: int) -> np.ndarray:
+        """Percentage change over `periods` observations, NaN for the first `periods`."""
+        out = np.empty_like(vals)
+        out[:periods] = np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[periods:] = (vals[periods:] / vals[:-periods] - 1.0) * 100.0
+        return out
+
 class IstatSeriesPlotter:
-    def __init__(self, series_dir: str = "./series", output_dir: str = "./images"):
+    def __init__(self, series_dir: str = "./series", output_dir: str = "./images", dpi: int = 150):
         self.series_dir = Path(series_dir)
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.dpi = dpi
         sns.set_theme()
+        
+        # Parsed time axes keyed on (frequency, time periods); series from the
+        # same dataset usually share one
+        self._time_cache: Dict[tuple, pd.DatetimeIndex] = {}
+        
+        # Figure reused across plots, created on first use
+        self._fig = None
+        self._ax1 = None
+        self._ax2 = None
+
+    def _get_axes(self):
+        """Return the shared figure and its two axes, cleared for a new plot."""
+        if self._fig is None:
+            self._fig, (self._ax1, self._ax2) = plt.subplots(2, 1, figsize=(15, 10), height_ratios=[2, 1])
+        else:
+            self._ax1.clear()
+            self._ax2.clear()
+        return self._fig, self._ax1, self._ax2
+
+    def close(self):
+        """Release the shared figure."""
+        if self._fig is not None:
+            plt.close(self._fig)
+            self._fig = self._ax1 = self._ax2 = None
 
     def load_series(self, file_path: Path) -> Dict:
         """Load a series JSON file."""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Error loading {file_path}: {e}")
-            raise
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
 
     def get_series_description(self, series_data: Dict) -> str:
         """Generate a comprehensive description from metadata and dataset info."""
@@ -66,29 +124,43 @@ class IstatSeriesPlotter:
             logger.error(f"Error generating description: {e}")
             return "Series Plot"
 
+    def _parse_time_index(self, freq_code: str, time_period: List[str]) -> pd.DatetimeIndex:
+        """Parse time periods with the single format implied by the series frequency."""
+        if freq_code == 'Q':
+            # Quarterly format (e.g., '1995-Q1')
+            index = pd.PeriodIndex(time_period, freq='Q').to_timestamp()
+        elif freq_code == 'A':
+            index = pd.to_datetime(time_period, format='%Y', cache=True)
+        elif freq_code == 'M':
+            index = pd.to_datetime(time_period, format='%Y-%m', cache=True)
+        else:
+            # Fallback to general parsing
+            index = pd.to_datetime(time_period, cache=True)
+        index.name = 'time_period'
+        return index
+
     def create_series_df(self, series_data: Dict) -> pd.DataFrame:
         """Convert series data to DataFrame with proper datetime index."""
-        try:
-            df = pd.DataFrame(series_data['observations'])
-            
-            # Handle different date formats
-            try:
-                # First try quarterly format (e.g., '1995-Q1')
-                df['time_period'] = pd.to_datetime(df['time_period'].str.replace('Q', ''))
-            except:
-                try:
-                    # Try annual format
-                    df['time_period'] = pd.to_datetime(df['time_period'], format='%Y')
-                except:
-                    # Fallback to general parsing
-                    df['time_period'] = pd.to_datetime(df['time_period'])
-            
-            df.set_index('time_period', inplace=True)
-            df.sort_index(inplace=True)
-            return df
-        except Exception as e:
-            logger.error(f"Error creating DataFrame: {e}")
-            raise
+        obs = series_data['observations']
+        if isinstance(obs, list):
+            # Older series files store one dict per observation
+            obs = {
+                'time_period': [o['time_period'] for o in obs],
+                'value': [o['value'] for o in obs]
+            }
+        freq_code = series_data.get('metadata', {}).get('FREQ', {}).get('code', 'A')
+        
+        key = (freq_code, tuple(obs['time_period']))
+        index = self._time_cache.get(key)
+        if index is None:
+            index = self._parse_time_index(freq_code, obs['time_period'])
+            if len(self._time_cache) >= 32:
+                self._time_cache.clear()
+            self._time_cache[key] = index
+        
+        df = pd.DataFrame({'value': np.asarray(obs['value'], dtype=np.float64)}, index=index)
+        df.sort_index(inplace=True)
+        return df
 
     def plot_series(self, series_data: Dict, output_filename: str):
         """Create a detailed plot of the time series."""
@@ -99,11 +171,12 @@ class IstatSeriesPlotter:
             # Get frequency from metadata
             freq_code = series_data.get('metadata', {}).get('FREQ', {}).get('code', 'A')
             
-            # Create figure
-            fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(15, 10), height_ratios=[2, 1])
+            # Reuse the figure; plot through matplotlib directly since pandas
+            # keeps per-axes frequency state that survives ax.clear()
+            fig, ax1, ax2 = self._get_axes()
             
             # Main time series plot
-            df['value'].plot(ax=ax1, linewidth=2)
+            ax1.plot(df.index, df['value'], linewidth=2)
             
             # Generate and set title
             title = self.get_series_description(series_data)
@@ -115,8 +188,9 @@ class IstatSeriesPlotter:
             
             # Calculate and plot growth rate
             periods = 4 if freq_code == 'Q' else 1
-            yoy = df['value'].pct_change(periods=periods) * 100
-            yoy.plot(ax=ax2, color='green', linewidth=2)
+            vals = df['value'].to_numpy(dtype=np.float64)
+            yoy = _growth(vals, periods)
+            ax2.plot(df.index, yoy, color='green', linewidth=2)
             
             ax2.axhline(y=0, color='r', linestyle='--', alpha=0.3)
             growth_title = 'Quarter-over-Quarter Growth Rate (%)' if freq_code == 'Q' else 'Year-over-Year Growth Rate (%)'
@@ -124,12 +198,18 @@ class IstatSeriesPlotter:
             ax2.grid(True, alpha=0.3)
             
             # Adjust layout
-            plt.tight_layout()
+            fig.tight_layout()
             
             # Save plot
             output_path = self.output_dir / output_filename
-            plt.savefig(output_path, dpi=300, bbox_inches='tight')
-            plt.close()
+            tmp_path = self.output_dir / f".{output_filename}.{os.getpid()}.tmp"
+            try:
+                fig.savefig(tmp_path, dpi=self.dpi, bbox_inches='tight', format='png')
+                os.replace(tmp_path, output_path)
+            except Exception:
+                # Don't leave a partial hidden file in the image directory
+                tmp_path.unlink(missing_ok=True)
+                raise
             
             logger.info(f"Plot saved to {output_path}")
             
@@ -175,27 +255,63 @@ class IstatSeriesPlotter:
             
             logger.info(f"Found {len(json_files)} JSON files to process")
             
+            # Several series map to the same image name. Render each name once,
+            # from the last file in glob order, which is the image a serial
+            # run over all files would leave on disk
+            targets: Dict[str, Path] = {}
             for file_path in json_files:
                 try:
-                    logger.info(f"Processing {file_path}")
-                    
-                    # Load series data
                     series_data = self.load_series(file_path)
-                    
-                    # Generate output filename
-                    output_filename = self.generate_output_filename(series_data, file_path)
-                    
-                    # Create plot
-                    self.plot_series(series_data, output_filename)
-                    
                 except Exception as e:
                     logger.error(f"Error processing file {file_path}: {e}")
                     continue
+                targets[self.generate_output_filename(series_data, file_path)] = file_path
+            
+            logger.info(f"Rendering {len(targets)} images")
+            
+            # Default worker count: one per CPU, capped at 61 on Windows
+            with ProcessPoolExecutor() as executor:
+                futures = {
+                    executor.submit(
+                        _render_one, str(file_path), output_filename, str(self.output_dir), self.dpi
+                    ): file_path
+                    for output_filename, file_path in targets.items()
+                }
+                
+                for future in as_completed(futures):
+                    file_path = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error(f"Error processing file {file_path}: {e}")
+                        continue
 
         except Exception as e:
             logger.error(f"Error processing files: {e}")
             raise
 
+# Plotter reused by all files rendered in the same worker process; its figure
+# lives until the worker exits when the pool shuts down
+_worker_plotter: Optional[IstatSeriesPlotter] = None
+
+def _render_one(file_path: str, output_filename: str, output_dir: str, dpi: int) -> str:
+    """Load and plot a single series file. Runs inside a worker process."""
+    global _worker_plotter
+    if (_worker_plotter is None or str(_worker_plotter.output_dir) != output_dir
+            or _worker_plotter.dpi != dpi):
+        plt.rcParams['path.simplify'] = True
+        _worker_plotter = IstatSeriesPlotter(output_dir=output_dir, dpi=dpi)
+    
+    file_path = Path(file_path)
+    logger.info(f"Processing {file_path}")
+    
+    # Load series data
+    series_data = _worker_plotter.load_series(file_path)
+    
+    # Create plot
+    _worker_plotter.plot_series(series_data, output_filename)
+    return output_filename
+
 def main():
     try:
         # Get the directory of the current script (src folder)
@@ -1,10 +1,13 @@
 import requests
-import json
+import orjson
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from xml.etree import ElementTree as ET
 from typing import Dict, Optional, List
 from datetime import datetime
+from pathlib import Path
 
 # Set up logging
 logging.basicConfig(
@@ -18,9 +21,14 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class IstatConstraintsBuilder:
+    BASE_URL = "https://sdmx.istat.it/SDMXWS/rest"
+    _AVAILABLE_CONSTRAINT_URL = BASE_URL + "/availableconstraint/{ds}"
+    _DATAFLOW_URL = BASE_URL + "/dataflow/IT1/{ds}"
+
     def __init__(self, dataset_id: str, mappings_dir: str = "./mappings"):
         self.dataset_id = dataset_id
-        self.base_url = "https://sdmx.istat.it/SDMXWS/rest"
+        self._available_constraint_url = self._AVAILABLE_CONSTRAINT_URL.format(ds=dataset_id)
+        self._dataflow_url = self._DATAFLOW_URL.format(ds=dataset_id)
         self.mappings_dir = mappings_dir
         self.output_dir = "./constraints"
         self.namespaces = {
@@ -30,13 +38,17 @@ class IstatConstraintsBuilder:
             'generic': 'http://www.sdmx.org/resources/sdmxml/schemas/v2_1/data/generic'
         }
         
+        # Keep-alive session shared by all requests to the SDMX endpoints
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        
         os.makedirs(self.output_dir, exist_ok=True)
 
     def fetch_xml(self, url: str) -> Optional[ET.Element]:
         """Fetch and parse XML from a URL."""
         try:
             logger.info(f"Fetching URL: {url}")
-            response = requests.get(url, timeout=30)
+            response = self.session.get(url, timeout=30)
             response.raise_for_status()
             return ET.fromstring(response.content)
         except Exception as e:
@@ -46,7 +58,7 @@ class IstatConstraintsBuilder:
     def get_available_constraints(self) -> Dict[str, List[str]]:
         """Get available constraints from the availableconstraint endpoint."""
         try:
-            url = f"{self.base_url}/availableconstraint/{self.dataset_id}"
+            url = self._available_constraint_url
             root = self.fetch_xml(url)
             
             constraints = {}
@@ -77,7 +89,7 @@ class IstatConstraintsBuilder:
     def get_dataflow_info(self) -> Dict:
         """Get dataset metadata from dataflow endpoint."""
         try:
-            url = f"{self.base_url}/dataflow/IT1/{self.dataset_id}"
+            url = self._dataflow_url
             root = self.fetch_xml(url)
             
             info = {
@@ -111,8 +123,8 @@ class IstatConstraintsBuilder:
         """Load the existing mapping file."""
         try:
             mapping_file = os.path.join(self.mappings_dir, f"mapping_{self.dataset_id}.json")
-            with open(mapping_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(mapping_file, 'rb') as f:
+                return orjson.loads(f.read())
         except Exception as e:
             logger.error(f"Error loading mapping file: {str(e)}")
             raise
@@ -122,50 +134,47 @@ class IstatConstraintsBuilder:
         try:
             logger.info(f"Building constraints overview for dataset {self.dataset_id}")
             
-            # Get dataflow info
-            dataflow_info = self.get_dataflow_info()
-            
-            # Get available constraints
-            available_constraints = self.get_available_constraints()
+            # Get dataflow info and available constraints concurrently
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                dataflow_future = executor.submit(self.get_dataflow_info)
+                constraints_future = executor.submit(self.get_available_constraints)
+                dataflow_info = dataflow_future.result()
+                available_constraints = constraints_future.result()
             
             # Load mapping file
             mapping = self.load_mapping_file()
             
-            # Initialize overview
+            # Value descriptions from the mapping, per available dimension
+            mapping_dims = mapping.get("dimensions", {})
+            mapped_values = {
+                dim_id: mapping_dims.get(dim_id, {}).get("values", {})
+                for dim_id in available_constraints
+            }
+            
+            # Build the overview; values missing from the mapping fall back to
+            # their code, and only the name field is kept (no empty description)
             overview = {
                 "dataset_info": dataflow_info,
                 "generated_at": datetime.now().isoformat(),
-                "dimensions": {}
-            }
-            
-            # Process each available constraint
-            for dim_id, values in available_constraints.items():
-                # Get dimension info from mapping if available
-                dim_info = mapping.get("dimensions", {}).get(dim_id, {})
-                
-                overview["dimensions"][dim_id] = {
-                    "id": dim_id,
-                    "values": {}
-                }
-                
-                # Process each value
-                for value in values:
-                    value_info = dim_info.get("values", {}).get(value, {})
-                    if value_info:
-                        # Only include name field without empty description
-                        overview["dimensions"][dim_id]["values"][value] = {
-                            "name": value_info.get("name", {"default": value})
-                        }
-                    else:
-                        # If no mapping found, use default without empty description
-                        overview["dimensions"][dim_id]["values"][value] = {
-                            "name": {"default": value}
+                "dimensions": {
+                    dim_id: {
+                        "id": dim_id,
+                        "values": {
+                            value: {
+                                "name": mapped_values[dim_id].get(value, {}).get("name") or {"default": value}
+                            }
+                            for value in values
                         }
+                    }
+                    for dim_id, values in available_constraints.items()
+                }
+            }
             
             # Save to file
             output_file = os.path.join(self.output_dir, f"constraints_{self.dataset_id}.json")
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(overview, f, indent=2, ensure_ascii=False)
+            Path(output_file).write_bytes(
+                orjson.dumps(overview, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            )
             
             logger.info(f"Successfully created constraints overview with {len(overview['dimensions'])} dimensions")
             return overview
@@ -1,15 +1,22 @@
 import requests
-import json
+import orjson
 import os
+import hashlib
+import sys
+import time
 import logging
-from xml.etree import ElementTree as ET
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree
 from typing import Dict, Optional, List, Tuple
 from dataclasses import dataclass
 from datetime import datetime
 
 # Set up logging
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
         logging.FileHandler('istat_mapping_builder.log'),
@@ -18,196 +25,429 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Namespace-qualified (Clark notation) tag names, usable without a prefix map
+STRUCTURE_NS = 'http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure'
+COMMON_NS = 'http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common'
+STRUCTURE_REF_PATH = f'.//{{{COMMON_NS}}}Structure'
+CODELIST_TAG = f'{{{STRUCTURE_NS}}}Codelist'
+CODE_TAG = f'{{{STRUCTURE_NS}}}Code'
+NAME_TAG = f'{{{COMMON_NS}}}Name'
+DESC_TAG = f'{{{COMMON_NS}}}Description'
+LANG_ATTR = '{http://www.w3.org/XML/1998/namespace}lang'
+
+# Language keys repeat on every name/description of every code; keep one
+# shared string per language instead of a fresh copy per attribute read
+_LANG_CACHE: Dict[str, str] = {}
+
+def _lang(value: str) -> str:
+    """Return the shared (interned) copy of a language key."""
+    cached = _LANG_CACHE.get(value)
+    if cached is None:
+        cached = _LANG_CACHE.setdefault(value, sys.intern(value))
+    return cached
+
+# The codelist walk stays in lxml + plain Python on purpose: it is bound by
+# network and XML parsing, not numeric work, and a Numba-compiled function
+# cannot call the lxml Element API. Only numeric post-processing over the
+# parsed codes (e.g. deduplicating hashed strings) would be worth compiling.
+def _code_entry(code: etree._Element) -> Dict[str, Dict]:
+    """Collect the names and descriptions (per language) of a Code element."""
+    name_tag, desc_tag, lang_attr, lang = NAME_TAG, DESC_TAG, LANG_ATTR, _lang
+    name_dict = {}
+    desc_dict = {}
+    
+    # Get names and descriptions in all languages in one pass
+    for child in code:
+        tag = child.tag
+        if tag == name_tag:
+            name_dict[lang(child.get(lang_attr, 'default'))] = child.text
+        elif tag == desc_tag:
+            desc_dict[lang(child.get(lang_attr, 'default'))] = child.text
+    return {"name": name_dict, "description": desc_dict}
+
+def _write_atomic(path: str, data: bytes):
+    """Write data to a temp file and move it into place, removing the temp file on failure."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+@dataclass(frozen=True)
 class DataStructureInfo:
     agency_id: str
     structure_id: str
     version: str
 
-@dataclass
+@dataclass(frozen=True)
 class CodelistRef:
     agency_id: str
     id: str
     version: str
 
 class IstatMappingBuilder:
-    def __init__(self, dataset_id: str, output_dir: str = "./mappings"):
+    # How long a codelist cached on disk is reused before it is fetched again
+    CODELIST_CACHE_TTL = 24 * 60 * 60
+
+    def __init__(self, dataset_id: str, output_dir: str = "./mappings", pretty: bool = True):
         self.dataset_id = dataset_id
+        self.pretty = pretty  # Indent the mapping file for human readers
         self.base_url = "https://sdmx.istat.it/SDMXWS/rest"
         self.output_dir = output_dir
+        self.cache_dir = os.path.join(output_dir, ".cache")
         self.namespaces = {
             'message': 'http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message',
             'structure': 'http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure',
             'common': 'http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common',
             'generic': 'http://www.sdmx.org/resources/sdmxml/schemas/v2_1/data/generic'
         }
+        
+        # XPath expressions compiled once and reused for every document
+        self._xp_dimension = etree.XPath('.//structure:Dimension', namespaces=self.namespaces)
+        self._xp_enum_ref = etree.XPath('.//structure:Enumeration/Ref', namespaces=self.namespaces)
+        
+        # Keep-alive session shared by all requests to the SDMX endpoints
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=16,
+            max_retries=Retry(total=3, backoff_factor=0.3)
+        ))
+        
+        # Codelists already loaded in this run, keyed on their reference
+        self._codelist_cache: Dict[CodelistRef, Dict] = {}
+        
         os.makedirs(output_dir, exist_ok=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        
+        # Validators (ETag / Last-Modified) and stored bodies of earlier
+        # responses, keyed on URL, for conditional requests
+        self._etags_path = os.path.join(self.cache_dir, "etags.json")
+        self._etags: Dict[str, Dict] = {}
+        if os.path.exists(self._etags_path):
+            with open(self._etags_path, 'rb') as f:
+                self._etags = orjson.loads(f.read())
 
-    def fetch_xml(self, url: str) -> Optional[ET.Element]:
-        """Fetch and parse XML from a URL."""
-        try:
-            logger.info(f"Fetching URL: {url}")
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            logger.debug(f"Successfully fetched from {url}")
-            return ET.fromstring(response.content)
-        except Exception as e:
-            logger.error(f"Error fetching {url}: {str(e)}")
-            raise
+    def fetch_xml(self, url: str, conditional: bool = False) -> Optional[etree._Element]:
+        """Fetch and parse XML from a URL.
+        
+        With conditional=True the request carries the validators of the last
+        response for this URL, and a 304 Not Modified is served from the body
+        stored on disk.
+        """
+        logger.info("Fetching URL: %s", url)
+        headers = {}
+        entry = self._etags.get(url) if conditional else None
+        if entry and os.path.exists(entry["body_path"]):
+            if entry.get("etag"):
+                headers['If-None-Match'] = entry["etag"]
+            if entry.get("last_modified"):
+                headers['If-Modified-Since'] = entry["last_modified"]
+        
+        response = self.session.get(url, timeout=30, headers=headers or None)
+        if response.status_code == 304 and headers:
+            logger.info("Not modified, using stored response for %s", url)
+            with open(entry["body_path"], 'rb') as f:
+                return etree.fromstring(f.read())
+        
+        response.raise_for_status()
+        logger.debug("Successfully fetched from %s", url)
+        if conditional:
+            self._store_validators(url, response)
+        # Hand the (already gunzipped) bytes straight to the parser; going
+        # through response.text would force a separate decode step first
+        return etree.fromstring(response.content)
+
+    def _store_validators(self, url: str, response: requests.Response):
+        """Keep the body and validators of a response for later conditional requests."""
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        
+        body_path = os.path.join(
+            self.cache_dir,
+            f"response_{hashlib.sha1(url.encode()).hexdigest()}.xml"
+        )
+        _write_atomic(body_path, response.content)
+        
+        self._etags[url] = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "body_path": body_path
+        }
+        _write_atomic(self._etags_path, orjson.dumps(self._etags))
 
     def get_structure_from_data(self) -> DataStructureInfo:
         """Get structure information from the data endpoint."""
-        try:
-            url = f"{self.base_url}/data/{self.dataset_id}"
-            root = self.fetch_xml(url)
-            
-            # Find the Structure element with common:Structure
-            struct_elem = root.find('.//common:Structure', self.namespaces)
-            if struct_elem is None:
-                raise ValueError("Structure element not found in data response")
-            
-            # Get the Ref element
-            ref_elem = struct_elem.find('Ref')
-            if ref_elem is None:
-                raise ValueError("Ref element not found in Structure")
-            
-            return DataStructureInfo(
-                agency_id=ref_elem.attrib.get('agencyID'),
-                structure_id=ref_elem.attrib.get('id'),
-                version=ref_elem.attrib.get('version')
-            )
-        except Exception as e:
-            logger.error(f"Error getting structure from data: {str(e)}")
-            raise
+        url = f"{self.base_url}/data/{self.dataset_id}"
+        root = self.fetch_xml(url)
+        
+        # Find the Structure element with common:Structure
+        struct_elem = root.find(STRUCTURE_REF_PATH)
+        if struct_elem is None:
+            raise ValueError("Structure element not found in data response")
+        
+        # Get the Ref element
+        ref_elem = struct_elem.find('Ref')
+        if ref_elem is None:
+            raise ValueError("Ref element not found in Structure")
+        
+        return DataStructureInfo(
+            agency_id=ref_elem.get('agencyID'),
+            structure_id=ref_elem.get('id'),
+            version=ref_elem.get('version')
+        )
 
     def get_dimension_codelist_refs(self, structure_info: DataStructureInfo) -> Dict[str, CodelistRef]:
         """Get codelist references for each dimension."""
-        try:
-            url = f"{self.base_url}/datastructure/{structure_info.agency_id}/{structure_info.structure_id}"
-            root = self.fetch_xml(url)
-            
-            codelist_refs = {}
+        # references=children returns the referenced codelists in the same
+        # message, saving one request per dimension
+        url = (
+            f"{self.base_url}/datastructure/{structure_info.agency_id}/{structure_info.structure_id}"
+            "?references=children&detail=full"
+        )
+        # The structure rarely changes between runs, so let the server
+        # answer 304 instead of sending the whole message again
+        root = self.fetch_xml(url, conditional=True)
+        
+        codelist_refs = {}
+        
+        debug = logger.isEnabledFor(logging.DEBUG)
+        
+        # Find all dimensions
+        dimensions = self._xp_dimension(root)
+        for dim in dimensions:
+            dim_id = dim.get('id')
+            if not dim_id:
+                continue
             
-            # Find all dimensions
-            dimensions = root.findall('.//structure:Dimension', self.namespaces)
-            for dim in dimensions:
-                dim_id = dim.attrib.get('id')
-                if not dim_id:
-                    continue
-                
-                # Find enumeration reference
-                enum_ref = dim.find('.//structure:Enumeration/Ref', self.namespaces)
-                if enum_ref is not None:
-                    codelist_refs[dim_id] = CodelistRef(
-                        agency_id=enum_ref.attrib.get('agencyID', structure_info.agency_id),
-                        id=enum_ref.attrib.get('id'),
-                        version=enum_ref.attrib.get('version', '1.0')
-                    )
-                    logger.debug(f"Found codelist reference for dimension {dim_id}: {codelist_refs[dim_id]}")
-            
-            return codelist_refs
-        except Exception as e:
-            logger.error(f"Error getting dimension codelist refs: {str(e)}")
-            raise
+            # Find enumeration reference
+            enum_refs = self._xp_enum_ref(dim)
+            if enum_refs:
+                enum_ref = enum_refs[0]
+                codelist_refs[dim_id] = CodelistRef(
+                    agency_id=enum_ref.get('agencyID', structure_info.agency_id),
+                    id=enum_ref.get('id'),
+                    version=enum_ref.get('version', '1.0')
+                )
+                if debug:
+                    logger.debug("Found codelist reference for dimension %s: %s", dim_id, codelist_refs[dim_id])
+        
+        # Keep the codelists that came along with the structure; the ones
+        # used only by attributes or measures are not needed for the mapping
+        needed = set(codelist_refs.values())
+        for codelist in root.iter(CODELIST_TAG):
+            ref = CodelistRef(
+                agency_id=codelist.get('agencyID'),
+                id=codelist.get('id'),
+                version=codelist.get('version')
+            )
+            if ref in needed:
+                self._codelist_cache[ref] = self._parse_codelist(codelist)
+        
+        return codelist_refs
+
+    def _parse_codelist(self, codelist: etree._Element) -> Dict[str, Dict]:
+        """Build codelist info and values from a fully parsed Codelist element."""
+        codelist_info = {
+            "name": {},
+            "description": {}
+        }
+        values = {}
+        code_tag, code_entry = CODE_TAG, _code_entry
+        
+        for child in codelist:
+            if child.tag == code_tag:
+                code_id = child.get('id')
+                if code_id:
+                    values[code_id] = code_entry(child)
+            elif child.tag == NAME_TAG:
+                codelist_info["name"][_lang(child.get(LANG_ATTR, 'default'))] = child.text
+            elif child.tag == DESC_TAG:
+                codelist_info["description"][_lang(child.get(LANG_ATTR, 'default'))] = child.text
+        
+        return {
+            "codelist_info": codelist_info,
+            "values": values
+        }
 
     def get_codelist_values(self, codelist_ref: CodelistRef) -> Dict[str, Dict]:
-        """Get all values and descriptions from a codelist."""
-        try:
-            url = f"{self.base_url}/codelist/{codelist_ref.agency_id}/{codelist_ref.id}"
-            root = self.fetch_xml(url)
-            
-            values = {}
+        """Get all values and descriptions from a codelist, using the memory and disk caches."""
+        codelist_data = self._codelist_cache.get(codelist_ref)
+        if codelist_data is not None:
+            return codelist_data
+        
+        cache_path = os.path.join(
+            self.cache_dir,
+            f"codelist_{codelist_ref.agency_id}_{codelist_ref.id}_{codelist_ref.version}.json"
+        )
+        if (os.path.exists(cache_path)
+                and time.time() - os.path.getmtime(cache_path) < self.CODELIST_CACHE_TTL):
+            logger.info("Using cached codelist %s from %s", codelist_ref.id, cache_path)
+            with open(cache_path, 'rb') as f:
+                codelist_data = orjson.loads(f.read())
+        else:
+            codelist_data = self._fetch_codelist_values(codelist_ref)
             
-            # Get codelist name and description
-            codelist_info = {
-                "name": {},
-                "description": {}
-            }
-            
-            for name in root.findall('.//structure:Name/common:Name', self.namespaces):
-                lang = name.attrib.get('{http://www.w3.org/XML/1998/namespace}lang', 'default')
-                codelist_info["name"][lang] = name.text
+            # Never leave a truncated cache entry behind
+            _write_atomic(cache_path, orjson.dumps(codelist_data))
+        
+        self._codelist_cache[codelist_ref] = codelist_data
+        return codelist_data
+
+    def _fetch_codelist_values(self, codelist_ref: CodelistRef) -> Dict[str, Dict]:
+        """Download and parse a codelist from the SDMX API."""
+        url = f"{self.base_url}/codelist/{codelist_ref.agency_id}/{codelist_ref.id}"
+        logger.info("Fetching URL: %s", url)
+        
+        values = {}
+        
+        # Get codelist name and description
+        codelist_info = {
+            "name": {},
+            "description": {}
+        }
+        
+        # Stream the codelist: each Code is handled as soon as it is parsed
+        # and then dropped, so only one code is kept in memory at a time
+        with self.session.get(url, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
             
-            # Get all codes
-            for code in root.findall('.//structure:Code', self.namespaces):
-                code_id = code.attrib.get('id')
-                if not code_id:
+            code_tag, code_entry = CODE_TAG, _code_entry
+            events = etree.iterparse(response.raw, events=('end',), tag=(CODE_TAG, NAME_TAG, DESC_TAG))
+            for _, elem in events:
+                if elem.tag != code_tag:
+                    # Names/descriptions of the codelist itself; the ones
+                    # inside a Code are read together with their Code
+                    if elem.getparent().tag == CODELIST_TAG:
+                        field = "name" if elem.tag == NAME_TAG else "description"
+                        lang = _lang(elem.get(LANG_ATTR, 'default'))
+                        codelist_info[field][lang] = elem.text
                     continue
                 
-                values[code_id] = {
-                    "name": {},
-                    "description": {}
-                }
-                
-                # Get names in all languages
-                for name in code.findall('.//common:Name', self.namespaces):
-                    lang = name.attrib.get('{http://www.w3.org/XML/1998/namespace}lang', 'default')
-                    values[code_id]["name"][lang] = name.text
+                code_id = elem.get('id')
+                if code_id:
+                    values[code_id] = code_entry(elem)
                 
-                # Get descriptions in all languages
-                for desc in code.findall('.//common:Description', self.namespaces):
-                    lang = desc.attrib.get('{http://www.w3.org/XML/1998/namespace}lang', 'default')
-                    values[code_id]["description"][lang] = desc.text
-            
-            return {
-                "codelist_info": codelist_info,
-                "values": values
-            }
-        except Exception as e:
-            logger.error(f"Error getting codelist values for {codelist_ref.id}: {str(e)}")
-            raise
+                # Free the processed code and the siblings already handled
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        
+        return {
+            "codelist_info": codelist_info,
+            "values": values
+        }
 
-    def build_mapping(self):
-        """Build complete mapping dictionary and save to JSON file."""
+    def build_mapping(self) -> Dict[str, object]:
+        """Build the mapping for all dimensions, streaming it to a JSON file.
+        
+        Returns a summary (dataset, output path, dimension and value counts)
+        rather than the mapping itself, which is only ever held on disk.
+        """
+        tmp_file = None
         try:
-            logger.info(f"Starting to build mapping for dataset {self.dataset_id}")
+            logger.info("Starting to build mapping for dataset %s", self.dataset_id)
             
             # Get structure info from data endpoint
             structure_info = self.get_structure_from_data()
-            logger.info(f"Found structure: {structure_info}")
+            logger.info("Found structure: %s", structure_info)
             
-            # Initialize mapping dictionary
-            mapping = {
+            # Mapping header; the dimensions are appended one at a time below
+            header = {
                 "dataset_id": self.dataset_id,
                 "generated_at": datetime.now().isoformat(),
                 "structure": {
                     "agency_id": structure_info.agency_id,
                     "id": structure_info.structure_id,
                     "version": structure_info.version
-                },
-                "dimensions": {}
+                }
             }
             
             # Get codelist references for all dimensions
             codelist_refs = self.get_dimension_codelist_refs(structure_info)
             
-            # Get values for each codelist
-            for dim_id, codelist_ref in codelist_refs.items():
-                logger.info(f"Processing dimension {dim_id} with codelist {codelist_ref.id}")
+            output_file = os.path.join(self.output_dir, f"mapping_{self.dataset_id}.json")
+            tmp_file = f"{output_file}.{os.getpid()}.tmp"
+            option = orjson.OPT_INDENT_2 if self.pretty else 0
+            # Dimension entries sit two levels deep in the pretty layout
+            indent = b"\n    " if self.pretty else b""
+            value_count = 0
+            
+            # Fetch the codelists concurrently; entries are written in
+            # dimension order so the mapping layout stays the same
+            with ThreadPoolExecutor(max_workers=8) as executor, open(tmp_file, 'wb') as f:
+                futures = {}
+                # Dimensions still to be written per codelist, so each codelist
+                # can be released as soon as its last dimension is on disk
+                pending = Counter(codelist_refs.values())
+                for dim_id, codelist_ref in codelist_refs.items():
+                    logger.info("Processing dimension %s with codelist %s", dim_id, codelist_ref.id)
+                    # Dimensions sharing a codelist only fetch it once
+                    if codelist_ref not in futures:
+                        futures[codelist_ref] = executor.submit(self.get_codelist_values, codelist_ref)
                 
-                codelist_data = self.get_codelist_values(codelist_ref)
+                # Header without its closing brace, then the open dimensions object
+                f.write(orjson.dumps(header, option=option)[:-1].rstrip())
+                f.write(b',\n  "dimensions": {' if self.pretty else b',"dimensions":{')
                 
-                mapping["dimensions"][dim_id] = {
-                    "codelist": {
-                        "id": codelist_ref.id,
-                        "agency_id": codelist_ref.agency_id,
-                        "version": codelist_ref.version,
-                        "name": codelist_data["codelist_info"]["name"],
-                        "description": codelist_data["codelist_info"]["description"]
-                    },
-                    "values": codelist_data["values"]
-                }
-            
-            # Save to file
-            output_file = os.path.join(self.output_dir, f"mapping_{self.dataset_id}.json")
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(mapping, f, indent=2, ensure_ascii=False)
+                separator = b""
+                for dim_id, codelist_ref in codelist_refs.items():
+                    codelist_data = futures[codelist_ref].result()
+                    value_count += len(codelist_data["values"])
+                    
+                    dim_entry = {
+                        "codelist": {
+                            "id": codelist_ref.id,
+                            "agency_id": codelist_ref.agency_id,
+                            "version": codelist_ref.version,
+                            "name": codelist_data["codelist_info"]["name"],
+                            "description": codelist_data["codelist_info"]["description"]
+                        },
+                        "values": codelist_data["values"]
+                    }
+                    # orjson escapes newlines inside strings, so re-indenting
+                    # on raw newlines only touches the layout
+                    fragment = orjson.dumps(dim_entry, option=option)
+                    if self.pretty:
+                        fragment = fragment.replace(b"\n", indent)
+                    f.write(separator + indent + orjson.dumps(dim_id) + (b": " if self.pretty else b":") + fragment)
+                    separator = b","
+                    
+                    del codelist_data, dim_entry, fragment
+                    pending[codelist_ref] -= 1
+                    if not pending[codelist_ref]:
+                        del futures[codelist_ref]
+                        self._codelist_cache.pop(codelist_ref, None)
+                
+                # Close the dimensions object and the mapping
+                if not self.pretty:
+                    f.write(b"}}")
+                elif codelist_refs:
+                    f.write(b"\n  }\n}")
+                else:
+                    f.write(b"}\n}")
+            os.replace(tmp_file, output_file)
             
-            logger.info(f"Mapping file created successfully: {output_file}")
-            return mapping
+            logger.info("Mapping file created successfully: %s", output_file)
+            return {
+                "dataset_id": self.dataset_id,
+                "output_file": output_file,
+                "dimensions": len(codelist_refs),
+                "values": value_count
+            }
             
-        except Exception as e:
-            logger.error(f"Error building mapping: {str(e)}")
+        except Exception:
+            logger.exception("Error building mapping for dataset %s", self.dataset_id)
+            # Drop the partly written mapping
+            if tmp_file is not None and os.path.exists(tmp_file):
+                os.remove(tmp_file)
             raise
 
 def main():
@@ -216,7 +456,7 @@ def main():
         builder = IstatMappingBuilder(dataset_id)
         builder.build_mapping()
     except Exception as e:
-        logger.critical(f"Script execution failed: {str(e)}")
+        logger.critical("Script execution failed: %s", e)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file